@@ -73,9 +73,17 @@
   scripts."devenv-generate-doc-options".exec = ''
     set -e
     options=$(nix build --extra-experimental-features 'flakes nix-command' --show-trace --print-out-paths --no-link '.#devenv-docs-options')
-    echo "# devenv.nix options" > docs/reference/options.md
-    echo >> docs/reference/options.md
-    cat $options >> docs/reference/options.md
+    tmp="$(mktemp)"
+    trap 'rm -f "$tmp"' EXIT
+    {
+      echo "# devenv.nix options"
+      echo
+      cat $options
+    } > "$tmp"
+    # only touch the file when the options changed, so mkdocs doesn't rebuild
+    if ! cmp -s "$tmp" docs/reference/options.md; then
+      cat "$tmp" > docs/reference/options.md
+    fi
   '';
   scripts."devenv-generate-languages-example".exec = ''
     cat > examples/supported-languages/devenv.nix <<EOF
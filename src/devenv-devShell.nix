@@ -20,7 +20,7 @@ pkgs.writeScriptBin "devenv" ''
     up)
       procfilescript=${config.procfileScript}
       cat $procfilescript
-      if [ "$(cat $procfilescript|tail -n +2)" = "" ]; then
+      if [ -z "$(tail -n +2 "$procfilescript")" ]; then
         echo "No 'processes' option defined: https://devenv.sh/processes/"
         exit 1
       else
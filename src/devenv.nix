@@ -10,7 +10,7 @@ pkgs.writeScriptBin "devenv" ''
   # we want subshells to fail the program
   set -e
 
-  NIX_FLAGS="--show-trace --extra-experimental-features nix-command --extra-experimental-features flakes"
+  NIX_FLAGS=(--show-trace --extra-experimental-features nix-command --extra-experimental-features flakes)
 
   # current hack to test if we have resolved all Nix annoyances
   export FLAKE_FILE=.devenv.flake.nix
@@ -25,15 +25,36 @@ pkgs.writeScriptBin "devenv" ''
 
     export DEVENV_DIR="$(pwd)/.devenv"
     export DEVENV_GC="$DEVENV_DIR/gc"
-    mkdir -p "$DEVENV_GC"
+    mkdir -p "$DEVENV_GC" "$GC_ROOT"
+    GC_DIR="$GC_ROOT/$(date +%s)"
     # TODO: validate devenv.yaml using jsonschema
     if [[ -f devenv.yaml ]]; then
-      cat devenv.yaml | ${pkgs.yaml2json}/bin/yaml2json > "$DEVENV_DIR/devenv.json"
+      # devenv.json carries devenv.yaml's mtime, so any mismatch (newer or
+      # older, e.g. a restored backup) means it has to be converted again
+      if [[ ! -f "$DEVENV_DIR/devenv.json" || devenv.yaml -nt "$DEVENV_DIR/devenv.json" || devenv.yaml -ot "$DEVENV_DIR/devenv.json" ]]; then
+        # per-process temp file, so concurrent runs never share or half-read it
+        json_tmp=$(mktemp "$DEVENV_DIR/devenv.json.XXXXXX")
+        if ! { ${pkgs.yaml2json}/bin/yaml2json < devenv.yaml > "$json_tmp" \
+               && touch -r devenv.yaml "$json_tmp" \
+               && mv -f "$json_tmp" "$DEVENV_DIR/devenv.json"; }; then
+          rm -f "$json_tmp"
+          exit 1
+        fi
+      fi
     else
       [[ -f "$DEVENV_DIR/devenv.json" ]] && rm "$DEVENV_DIR/devenv.json"
     fi
-    cp -f ${import ./flake.nix { inherit pkgs version; }} "$FLAKE_FILE"
-    chmod +w "$FLAKE_FILE"
+    flake=${import ./flake.nix { inherit pkgs version; }}
+    # skip the copy when the flake is up to date, which also keeps its mtime
+    if ! ${pkgs.diffutils}/bin/cmp -s "$flake" "$FLAKE_FILE"; then
+      flake_tmp=$(mktemp "$FLAKE_FILE.XXXXXX")
+      if ! { cp -f "$flake" "$flake_tmp" \
+             && chmod 644 "$flake_tmp" \
+             && mv -f "$flake_tmp" "$FLAKE_FILE"; }; then
+        rm -f "$flake_tmp"
+        exit 1
+      fi
+    fi
   }
 
   if [[ -z "$XDG_DATA_HOME" ]]; then
@@ -42,22 +63,26 @@ pkgs.writeScriptBin "devenv" ''
     GC_ROOT="$XDG_DATA_HOME/devenv/gc"
   fi
 
-  mkdir -p "$GC_ROOT"
-  GC_DIR="$GC_ROOT/$(date +%s)"
-
   function add_gc {
     name=$1
     storePath=$2
 
-    nix-store --add-root "$DEVENV_GC/$name" -r $storePath >/dev/null
+    # callers register "$DEVENV_GC/$name" as a root (nix build --out-link or nix-store --add-root)
     ln -sf $storePath "$GC_DIR-$name"
   }
 
+  function cleanup_symlinks {
+    # unlink GC links whose target is no longer a file, in a single find pass
+    ${pkgs.findutils}/bin/find "$GC_ROOT" -type l ! -xtype f -delete
+  }
+
   function shell {
     assemble
     echo "Building shell ..." 1>&2
-    env=$($CUSTOM_NIX/bin/nix $NIX_FLAGS print-dev-env --impure --profile "$DEVENV_GC/shell")
-    $CUSTOM_NIX/bin/nix-env -p "$DEVENV_GC/shell" --delete-generations old 2>/dev/null
+    env=$($CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" print-dev-env --impure --profile "$DEVENV_GC/shell")
+    # pruning old generations is housekeeping, don't make the shell wait for it;
+    # keep stdout closed so callers capturing it (e.g. direnv) don't block
+    $CUSTOM_NIX/bin/nix-env -p "$DEVENV_GC/shell" --delete-generations old >/dev/null 2>&1 &
     ln -sf $(${pkgs.coreutils}/bin/readlink -f "$DEVENV_GC/shell") "$GC_DIR-shell"
   }
 
@@ -70,12 +95,14 @@ pkgs.writeScriptBin "devenv" ''
     up)
       shell
       eval "$env"
-      procfilescript=$($CUSTOM_NIX/bin/nix $NIX_FLAGS build --no-link --print-out-paths --impure '.#procfileScript')
+      procfilescript=$($CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" build --no-link --print-out-paths --impure '.#procfileScript')
       cat $procfilescript
-      if [ "$(cat $procfilescript|tail -n +2)" = "" ]; then
+      if [ -z "$(tail -n +2 "$procfilescript")" ]; then
         echo "No 'processes' option defined: https://devenv.sh/processes/"  
         exit 1
       else
+        # only root the script once we know there are processes to run
+        $CUSTOM_NIX/bin/nix-store --add-root "$DEVENV_GC/procfilescript" -r $procfilescript >/dev/null
         add_gc procfilescript $procfilescript
         $procfilescript
       fi
@@ -89,19 +116,19 @@ pkgs.writeScriptBin "devenv" ''
       if [ $# -eq 0 ]; then
         echo "Entering shell ..." 1>&2
         echo "" 1>&2
-        $CUSTOM_NIX/bin/nix $NIX_FLAGS develop "$DEVENV_GC/shell"
+        $CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" develop "$DEVENV_GC/shell"
       else
         set -e
-        $CUSTOM_NIX/bin/nix $NIX_FLAGS develop "$DEVENV_GC/shell" -c "$@"
+        $CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" develop "$DEVENV_GC/shell" -c "$@"
       fi
       ;;
     search)
       name=$1
       shift
       assemble
-      options=$($CUSTOM_NIX/bin/nix $NIX_FLAGS build --no-link --print-out-paths '.#optionsJSON' --impure)
-      results=$($CUSTOM_NIX/bin/nix $NIX_FLAGS search --json nixpkgs $name)
-      results_options=$(cat $options/share/doc/nixos/options.json | ${pkgs.jq}/bin/jq "with_entries(select(.key | contains(\"$name\")))")
+      options=$($CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" build --no-link --print-out-paths '.#optionsJSON' --impure)
+      results=$($CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" search --json nixpkgs "$name")
+      results_options=$(${pkgs.jq}/bin/jq --arg name "$name" 'with_entries(select(.key | contains($name)))' "$options/share/doc/nixos/options.json")
       if [ "$results" = "{}" ]; then
         echo "No packages found for '$name'."
       else
@@ -148,18 +175,11 @@ pkgs.writeScriptBin "devenv" ''
         cat ${examples}/$example/devenv.yaml > devenv.yaml
       fi
 
-      if [[ ! -f .gitignore ]]; then
-        touch .gitignore
-      fi
-
-      if ! grep -q "devenv" .gitignore; then
+      # a missing .gitignore is created by the append below
+      if ! grep -qs "devenv" .gitignore; then
         echo "Appending .devenv* and devenv.local.nix to .gitignore"
 
-        echo "" >> .gitignore
-        echo "# Devenv" >> .gitignore
-        echo ".devenv*" >> .gitignore
-        echo "devenv.local.nix" >> .gitignore
-        echo "" >> .gitignore
+        printf '\n# Devenv\n.devenv*\ndevenv.local.nix\n\n' >> .gitignore
       fi
       echo "Done."
 
@@ -170,36 +190,33 @@ pkgs.writeScriptBin "devenv" ''
       ;;
     info)
       assemble
-      $CUSTOM_NIX/bin/nix $NIX_FLAGS flake metadata | grep Inputs -A10000
+      $CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" flake metadata | sed -n '/Inputs/,$p'
       echo
-      $CUSTOM_NIX/bin/nix $NIX_FLAGS eval --raw '.#info' --impure
+      $CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" eval --raw '.#info' --impure
       ;;
     update)
       assemble
-      $CUSTOM_NIX/bin/nix $NIX_FLAGS flake update
+      $CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" flake update
       ;;
     version)
       echo "devenv: ${version}"
       ;;
     ci)
       assemble
-      ci=$($CUSTOM_NIX/bin/nix $NIX_FLAGS build --no-link --print-out-paths '.#ci' --impure)
+      ci=$($CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" build --out-link "$DEVENV_GC/ci" --print-out-paths '.#ci' --impure)
       add_gc ci $ci
       ;;
     gc)
       SECONDS=0
+      mkdir -p "$GC_ROOT"
 
-      for link in $(${pkgs.findutils}/bin/find $GC_ROOT -type l); do
-        if [ ! -f $link ]; then
-          unlink $link
-        fi
-      done
+      cleanup_symlinks
 
       echo "Counting old devenvs ..."
       echo
       candidates=$(${pkgs.findutils}/bin/find $GC_ROOT -type l)
 
-      before=$($CUSTOM_NIX/bin/nix $NIX_FLAGS path-info $candidates -S --json | ${pkgs.jq}/bin/jq '[.[].closureSize | tonumber] | add')
+      before=$($CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" path-info $candidates -S --json | ${pkgs.jq}/bin/jq '[.[].closureSize | tonumber] | add')
       paths=$($CUSTOM_NIX/bin/nix-store -qR $candidates)
 
       echo "Found $(echo $paths | wc -w) store paths of sum size $(( $before / 1024 / 1024 )) MB."
@@ -208,16 +225,12 @@ pkgs.writeScriptBin "devenv" ''
       echo
       echo "Note: If you'd like this command to run much faster, leave a thumbs up at https://github.com/NixOS/nix/issues/7239"
 
-      echo $paths  | tr ' ' '\n' | ${pkgs.parallel}/bin/parallel -j8 $CUSTOM_NIX/bin/nix $NIX_FLAGS store delete >/dev/null 2>/dev/null
+      echo "$paths" | ${pkgs.parallel}/bin/parallel -j8 $CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" store delete >/dev/null 2>/dev/null
   
       # after GC delete links again
-      for link in $(${pkgs.findutils}/bin/find $GC_ROOT -type l); do
-        if [ ! -f $link ]; then
-          unlink $link
-        fi
-      done
+      cleanup_symlinks
 
-      after=$($CUSTOM_NIX/bin/nix $NIX_FLAGS path-info $(${pkgs.findutils}/bin/find $GC_ROOT -type l) -S --json | ${pkgs.jq}/bin/jq '[.[].closureSize | tonumber] | add')
+      after=$($CUSTOM_NIX/bin/nix "''${NIX_FLAGS[@]}" path-info $(${pkgs.findutils}/bin/find $GC_ROOT -type l) -S --json | ${pkgs.jq}/bin/jq '[.[].closureSize | tonumber] | add')
       echo
       echo "Done. Saved $((($before - $after) / 1024 / 1024 )) MB in $SECONDS seconds."
       ;;